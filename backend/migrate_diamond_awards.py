@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+One-off migration for the diamond_awards collection - run once before deploying
+the integer award dates:
+
+    python migrate_diamond_awards.py
+
+1. Converts "YYYY-MM-DD" string dates to the YYYYMMDD ints award_diamond writes.
+2. Removes duplicate awards left by the old find-then-insert race, keeping the
+   earliest award of each user/type/day.
+3. Builds the unique (user_id, type, date) index award_diamond relies on.
+
+Safe to re-run: every step is a no-op once the collection is migrated.
+"""
+
+import os
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+
+load_dotenv()
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "spynners_db")
+
+
+def migrate_string_dates(awards):
+    migrated = 0
+    for award in awards.find({"date": {"$type": "string"}}, {"date": 1}):
+        try:
+            awards.update_one({"_id": award["_id"]}, {"$set": {"date": int(award["date"].replace("-", ""))}})
+            migrated += 1
+        except DuplicateKeyError:
+            # The same day was already awarded in the new format
+            awards.delete_one({"_id": award["_id"]})
+    print(f"[Migration] Converted {migrated} string dates to integers")
+
+
+def remove_duplicate_awards(awards):
+    duplicates = awards.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": {"user_id": "$user_id", "type": "$type", "date": "$date"}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ])
+    extra_ids = [award_id for group in duplicates for award_id in group["ids"][1:]]
+    if extra_ids:
+        awards.delete_many({"_id": {"$in": extra_ids}})
+    print(f"[Migration] Removed {len(extra_ids)} duplicate awards")
+
+
+def main():
+    awards = MongoClient(MONGO_URL)[DB_NAME]["diamond_awards"]
+    migrate_string_dates(awards)
+    remove_duplicate_awards(awards)
+    awards.create_index([("user_id", 1), ("type", 1), ("date", 1)], unique=True)
+    print("[Migration] Unique (user_id, type, date) index in place")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,25 +8,38 @@ SPYNNERS Backend Server
 """
 
 import os
+import asyncio
 import base64
 import hashlib
 import hmac
 import time
 import json
+import logging
+import logging.handlers
+import queue
 import uuid
+import zlib
 import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Optional, List
 from io import BytesIO
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Depends, Request
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Header, Depends, Request, BackgroundTasks
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+from fastapi.responses import FileResponse, ORJSONResponse, Response
+from pydantic import BaseModel, ValidationError, field_validator
 from dotenv import load_dotenv
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
 import httpx
+import orjson
+from cachetools import TTLCache
 
 # For MP3 metadata extraction
 try:
@@ -38,6 +51,13 @@ except ImportError:
     MUTAGEN_AVAILABLE = False
     print("Warning: mutagen not available, MP3 metadata extraction disabled")
 
+# SIMD-accelerated base64 for cover art / audio data URIs (same API as stdlib)
+try:
+    import pybase64
+except ImportError:
+    pybase64 = base64
+    print("Warning: pybase64 not available, using stdlib base64 for data URIs")
+
 # For automatic BPM detection
 try:
     import librosa
@@ -48,7 +68,7 @@ except ImportError:
 
 load_dotenv()
 
-app = FastAPI(title="SPYNNERS API", version="1.0.0")
+app = FastAPI(title="SPYNNERS API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS
 app.add_middleware(
@@ -59,12 +79,86 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger JSON bodies (Base44 proxies, track lists) for clients that accept gzip.
+# Audio/image files, ZIP/PDF downloads and 206 range responses pass through untouched:
+# they are already compressed, and gzip would drop Content-Length under Content-Range.
+# The decision is made on http.response.start, so it doesn't depend on Starlette internals.
+class JSONGZipMiddleware:
+    def __init__(self, app, minimum_size: int = 500, compresslevel: int = 9):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("Accept-Encoding", ""):
+            await self.app(scope, receive, send)
+            return
+        
+        start_message = None
+        compress = False
+        compressor = None
+        
+        async def send_maybe_gzipped(message):
+            nonlocal start_message, compress, compressor
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                compress = (
+                    message["status"] != 206
+                    and headers.get("content-type", "").startswith("application/json")
+                    and "content-encoding" not in headers
+                )
+                if compress:
+                    # Held back until the first body chunk shows whether it is worth compressing
+                    start_message = message
+                else:
+                    await send(message)
+                return
+            
+            if message["type"] != "http.response.body" or not compress:
+                await send(message)
+                return
+            
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message["headers"])
+                if not more_body and len(body) < self.minimum_size:
+                    compress = False
+                    await send(start_message)
+                    await send(message)
+                    return
+                # wbits=31 writes a gzip header and trailer
+                compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, 31)
+                headers["Content-Encoding"] = "gzip"
+                headers.add_vary_header("Accept-Encoding")
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+                start_message, pending_start = None, start_message
+                body = compressor.compress(body) + (b"" if more_body else compressor.flush())
+                if not more_body:
+                    headers["Content-Length"] = str(len(body))
+                await send(pending_start)
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+            
+            body = compressor.compress(body) + (compressor.flush(zlib.Z_SYNC_FLUSH) if more_body else compressor.flush())
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+        
+        await self.app(scope, receive, send_maybe_gzipped)
+
+
+app.add_middleware(JSONGZipMiddleware, minimum_size=500, compresslevel=5)
+
 # MongoDB
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "spynners_db")
 client = MongoClient(MONGO_URL)
 db = client[DB_NAME]
 
+# Async (Motor) handle for hot paths that must not block the event loop
+motor_client = AsyncIOMotorClient(MONGO_URL)
+async_db = motor_client[DB_NAME]
+
 # Spynners Native API Base URL
 SPYNNERS_FUNCTIONS_URL = "https://spynners.base44.app/functions"
 
@@ -74,6 +168,55 @@ tracks_collection = db["tracks"]
 messages_collection = db["messages"]
 playlists_collection = db["playlists"]
 recognition_history_collection = db["recognition_history"]
+diamond_awards_collection = async_db["diamond_awards"]
+
+
+# Number of uvicorn worker processes sharing this host; each one has its own CPU pool.
+# Unset means a single `uvicorn server:app` process, so that process gets every core.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+@app.on_event("startup")
+async def startup_worker_pools():
+    # CPU-bound audio analysis (librosa) runs here so it never blocks the event loop.
+    # Cores are split across the uvicorn workers so they don't oversubscribe the host.
+    # "spawn" because forking this process would copy the Mongo monitor and log
+    # listener threads' locks into the child, where they can deadlock.
+    app.state.cpu_pool = ProcessPoolExecutor(
+        max_workers=max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown_worker_pools():
+    app.state.cpu_pool.shutdown(wait=False, cancel_futures=True)
+
+
+@app.on_event("startup")
+def ensure_indexes():
+    try:
+        # "user's playlists newest first" - the user_id prefix also serves plain user_id lookups
+        playlists_collection.create_index([("user_id", 1), ("created_at", -1)])
+        # /api/tracks, newest first - unfiltered, and with the optional genre filter
+        tracks_collection.create_index([("created_at", -1)])
+        tracks_collection.create_index([("genre", 1), ("created_at", -1)])
+    except Exception as e:
+        print(f"[MongoDB] Could not create indexes: {e}")
+
+
+# The unique (user_id, type, date) index is the only once-per-day guard in
+# award_diamond, which refuses awards (503) until it is known to exist. Existing
+# string dates and duplicates are cleaned up beforehand by migrate_diamond_awards.py.
+DIAMOND_AWARD_INDEX_KEYS = [("user_id", 1), ("type", 1), ("date", 1)]
+DIAMOND_AWARD_INDEX = {"ready": False}
+
+@app.on_event("startup")
+def ensure_diamond_award_index():
+    try:
+        db["diamond_awards"].create_index(DIAMOND_AWARD_INDEX_KEYS, unique=True)
+        DIAMOND_AWARD_INDEX["ready"] = True
+    except Exception as e:
+        print(f"[MongoDB] Could not create the diamond_awards unique index, awards disabled: {e}")
 
 # ACRCloud Configuration - OFFLINE (Spynners Catalog) - Primary
 ACRCLOUD_HOST = os.getenv("ACRCLOUD_HOST", "identify-eu-west-1.acrcloud.com")
@@ -190,18 +333,22 @@ async def local_login(request: LocalLoginRequest):
 
 # ==================== ACRCLOUD RECOGNITION ====================
 
+# Keyed HMAC-SHA1 state per ACRCloud secret, reused across requests
+_ACRCLOUD_HMAC_TEMPLATES = {}
+
 def generate_acrcloud_signature(http_method: str, http_uri: str, access_key: str, 
                                  data_type: str, signature_version: str, timestamp: str, 
                                  access_secret: str) -> str:
     """Generate ACRCloud API signature"""
     string_to_sign = f"{http_method}\n{http_uri}\n{access_key}\n{data_type}\n{signature_version}\n{timestamp}"
-    sign = base64.b64encode(
-        hmac.new(
-            access_secret.encode('ascii'),
-            string_to_sign.encode('ascii'),
-            digestmod=hashlib.sha1
-        ).digest()
-    ).decode('ascii')
+    # Key setup is done once per secret; each request only copies the keyed state
+    template = _ACRCLOUD_HMAC_TEMPLATES.get(access_secret)
+    if template is None:
+        template = hmac.new(access_secret.encode('ascii'), digestmod=hashlib.sha1)
+        _ACRCLOUD_HMAC_TEMPLATES[access_secret] = template
+    mac = template.copy()
+    mac.update(string_to_sign.encode('ascii'))
+    sign = base64.b64encode(mac.digest()).decode('ascii')
     return sign
 
 @app.post("/api/recognize-audio")
@@ -1042,29 +1189,83 @@ async def update_track(track_id: str, request: Request, authorization: Optional[
         print(f"[Tracks] Error updating track: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+class TrackUploadForm(BaseModel):
+    title: str
+    artist: str
+    genre: str
+    producer_name: Optional[str] = None
+    collaborators: Optional[str] = None
+    label: Optional[str] = None
+    bpm: Optional[int] = None
+    key: Optional[str] = None
+    energy_level: Optional[str] = None
+    mood: Optional[str] = None
+    description: Optional[str] = None
+    is_vip: bool = False
+    isrc_code: Optional[str] = None
+    iswc_code: Optional[str] = None
+    release_date: Optional[str] = None
+    copyright: Optional[str] = None
+    audio_url: Optional[str] = None
+    audio_name: Optional[str] = None
+    artwork_url: Optional[str] = None
+
+    @field_validator("bpm", mode="before")
+    @classmethod
+    def drop_non_numeric_bpm(cls, value):
+        # Non-numeric BPM values are ignored rather than rejected
+        if isinstance(value, str) and not value.isdigit():
+            return None
+        return value
+
+    @field_validator("is_vip", mode="before")
+    @classmethod
+    def parse_is_vip(cls, value):
+        # Only "true" (any case) counts - anything else, including "" or "1", is False
+        if isinstance(value, bool):
+            return value
+        return str(value).strip().lower() == "true"
+
+    @classmethod
+    def as_form(
+        cls,
+        title: str = Form(...),
+        artist: str = Form(...),
+        genre: str = Form(...),
+        producer_name: str = Form(None),
+        collaborators: str = Form(None),
+        label: str = Form(None),
+        bpm: str = Form(None),
+        key: str = Form(None),
+        energy_level: str = Form(None),
+        mood: str = Form(None),
+        description: str = Form(None),
+        is_vip: str = Form("false"),
+        isrc_code: str = Form(None),
+        iswc_code: str = Form(None),
+        release_date: str = Form(None),
+        copyright: str = Form(None),
+        audio_url: str = Form(None),
+        audio_name: str = Form(None),
+        artwork_url: str = Form(None),
+    ) -> "TrackUploadForm":
+        try:
+            return cls(
+                title=title, artist=artist, genre=genre, producer_name=producer_name,
+                collaborators=collaborators, label=label, bpm=bpm, key=key,
+                energy_level=energy_level, mood=mood, description=description,
+                is_vip=is_vip, isrc_code=isrc_code, iswc_code=iswc_code,
+                release_date=release_date, copyright=copyright, audio_url=audio_url,
+                audio_name=audio_name, artwork_url=artwork_url
+            )
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+
 @app.post("/api/tracks/upload")
 async def upload_track(
-    title: str = Form(...),
-    artist: str = Form(...),
-    genre: str = Form(...),
-    producer_name: str = Form(None),
-    collaborators: str = Form(None),
-    label: str = Form(None),
-    bpm: str = Form(None),
-    key: str = Form(None),
-    energy_level: str = Form(None),
-    mood: str = Form(None),
-    description: str = Form(None),
-    is_vip: str = Form("false"),
-    isrc_code: str = Form(None),
-    iswc_code: str = Form(None),
-    release_date: str = Form(None),
-    copyright: str = Form(None),
+    form: TrackUploadForm = Depends(TrackUploadForm.as_form),
     audio: UploadFile = File(None),
     artwork: UploadFile = File(None),
-    audio_url: str = Form(None),
-    audio_name: str = Form(None),
-    artwork_url: str = Form(None),
     authorization: Optional[str] = Header(None)
 ):
     """Upload a new track"""
@@ -1073,43 +1274,30 @@ async def upload_track(
         audio_data = None
         if audio:
             content = await audio.read()
-            audio_data = f"data:audio/mpeg;base64,{base64.b64encode(content).decode()}"
-        elif audio_url:
-            audio_data = audio_url
+            audio_data = f"data:audio/mpeg;base64,{pybase64.b64encode(content).decode()}"
+        elif form.audio_url:
+            audio_data = form.audio_url
         
         # Process artwork
         artwork_data = None
         if artwork:
             content = await artwork.read()
-            artwork_data = f"data:image/jpeg;base64,{base64.b64encode(content).decode()}"
-        elif artwork_url:
-            artwork_data = artwork_url
+            artwork_data = f"data:image/jpeg;base64,{pybase64.b64encode(content).decode()}"
+        elif form.artwork_url:
+            artwork_data = form.artwork_url
         
         # Parse collaborators
         collab_list = []
-        if collaborators:
+        if form.collaborators:
             try:
-                collab_list = json.loads(collaborators)
+                collab_list = orjson.loads(form.collaborators)
             except:
-                collab_list = [collaborators]
+                collab_list = [form.collaborators]
         
         track = {
-            "title": title,
-            "artist": artist,
-            "genre": genre,
-            "producer_name": producer_name or artist,
+            **form.model_dump(exclude={"collaborators", "audio_url", "audio_name", "artwork_url"}),
+            "producer_name": form.producer_name or form.artist,
             "collaborators": collab_list,
-            "label": label,
-            "bpm": int(bpm) if bpm and bpm.isdigit() else None,
-            "key": key,
-            "energy_level": energy_level,
-            "mood": mood,
-            "description": description,
-            "is_vip": is_vip.lower() == "true",
-            "isrc_code": isrc_code,
-            "iswc_code": iswc_code,
-            "release_date": release_date,
-            "copyright": copyright,
             "audio_url": audio_data,
             "artwork_url": artwork_data,
             "status": "pending",  # pending, approved, rejected
@@ -1232,11 +1420,25 @@ class SpynNotificationRequest(BaseModel):
     longitude: Optional[float] = None
     played_at: Optional[str] = None
 
+async def _send_base44_notify(function_url: str, payload: dict, headers: dict):
+    """Call the Base44 notification function (runs as a background task)"""
+    try:
+        response = await BASE44_HTTP.post(function_url, json=payload, headers=headers)
+        if response.status_code != 200:
+            print(f"Base44 notification error: {response.status_code} - {response.text}")
+    except Exception as e:
+        print(f"Producer notification error: {e}")
+
 @app.post("/api/notify-producer")
-async def notify_producer(request: SpynNotificationRequest, authorization: Optional[str] = Header(None)):
+async def notify_producer(
+    request: SpynNotificationRequest,
+    background_tasks: BackgroundTasks,
+    authorization: Optional[str] = Header(None)
+):
     """
     Notify the producer when their track is played (SPYNed) by a DJ.
-    Calls the Base44 sendTrackPlayedEmail cloud function.
+    Calls the Base44 sendTrackPlayedEmail cloud function in the background,
+    so the SPYN response never waits on Base44.
     """
     try:
         # Extract Bearer token
@@ -1279,28 +1481,12 @@ async def notify_producer(request: SpynNotificationRequest, authorization: Optio
         if user_token:
             headers["Authorization"] = f"Bearer {user_token}"
         
-        async with httpx.AsyncClient(timeout=30.0) as http_client:
-            response = await http_client.post(
-                BASE44_FUNCTION_URL,
-                json=payload,
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return {
-                    "success": True,
-                    "message": "Producer notification sent successfully",
-                    "details": result
-                }
-            else:
-                # Log the error but don't fail the SPYN operation
-                print(f"Base44 notification error: {response.status_code} - {response.text}")
-                return {
-                    "success": False,
-                    "message": "Notification service unavailable",
-                    "status_code": response.status_code
-                }
+        background_tasks.add_task(_send_base44_notify, BASE44_FUNCTION_URL, payload, headers)
+        return {
+            "success": True,
+            "message": "Producer notification queued",
+            "queued": True
+        }
                 
     except Exception as e:
         # Don't fail the entire SPYN operation if notification fails
@@ -1316,6 +1502,65 @@ async def notify_producer(request: SpynNotificationRequest, authorization: Optio
 BASE44_API_URL = "https://app.base44.com/api"
 BASE44_APP_ID = "691a4d96d819355b52c063f3"
 
+# Constant parts of every Base44 request - handlers only overlay Authorization
+BASE44_HEADERS = {"Content-Type": "application/json", "X-Base44-App-Id": BASE44_APP_ID}
+USER_ENTITY_PATH_TPL = f"/apps/{BASE44_APP_ID}/entities/User/{{}}"
+
+SPYNNERS_APP_FUNCTIONS_URL = "https://spynners.com/api/functions"
+# Statuses from the app host that still get a retry on the platform API
+APP_FUNCTION_FALLTHROUGH_STATUSES = {401, 403, 404}
+
+# Shared clients - created once per worker so calls reuse warm TLS connections,
+# and HTTP/2 lets concurrent proxy calls share one connection
+BASE44_HTTP: Optional[httpx.AsyncClient] = None
+APP_FUNCTION_HTTP: Optional[httpx.AsyncClient] = None
+
+def _pooled_client(base_url: str) -> httpx.AsyncClient:
+    # Connection failures are retried at the socket level, never as a second application POST
+    return httpx.AsyncClient(
+        base_url=base_url,
+        timeout=30.0,
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+        )
+    )
+
+# Base44 proxy logging goes through a queue drained on a background thread,
+# so handlers never block on stdout
+base44_logger = logging.getLogger("base44")
+base44_logger.setLevel(os.getenv("BASE44_LOG_LEVEL", "INFO"))
+base44_logger.propagate = False
+_base44_log_queue = queue.Queue(-1)
+base44_logger.addHandler(logging.handlers.QueueHandler(_base44_log_queue))
+_base44_log_handler = logging.StreamHandler()
+_base44_log_handler.setFormatter(logging.Formatter("[Base44] %(message)s"))
+_base44_log_listener = logging.handlers.QueueListener(_base44_log_queue, _base44_log_handler)
+
+@app.on_event("startup")
+async def startup_base44_clients():
+    global BASE44_HTTP, APP_FUNCTION_HTTP
+    BASE44_HTTP = _pooled_client(BASE44_API_URL)
+    APP_FUNCTION_HTTP = _pooled_client(SPYNNERS_APP_FUNCTIONS_URL)
+    _base44_log_listener.start()
+
+@app.on_event("shutdown")
+async def shutdown_base44_clients():
+    # Flush queued diamond updates while the clients are still open
+    await shutdown_award_consumers()
+    await BASE44_HTTP.aclose()
+    await APP_FUNCTION_HTTP.aclose()
+    _base44_log_listener.stop()
+
+def base44_passthrough(response: httpx.Response) -> Response:
+    """Forward an upstream Base44 JSON body as-is, without decoding and re-encoding it"""
+    return Response(
+        content=response.content,
+        media_type="application/json",
+        status_code=response.status_code
+    )
+
 class Base44LoginRequest(BaseModel):
     email: str
     password: str
@@ -1330,31 +1575,27 @@ class Base44SignupRequest(BaseModel):
 async def base44_login(request: Base44LoginRequest):
     """Proxy login request to Base44 to avoid CORS issues"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as http_client:
-            response = await http_client.post(
-                f"{BASE44_API_URL}/apps/{BASE44_APP_ID}/auth/login",
-                json={"email": request.email, "password": request.password},
-                headers={
-                    "Content-Type": "application/json",
-                    "X-Base44-App-Id": BASE44_APP_ID
-                }
-            )
+        response = await BASE44_HTTP.post(
+            f"/apps/{BASE44_APP_ID}/auth/login",
+            json={"email": request.email, "password": request.password},
+            headers=BASE44_HEADERS
+        )
+        
+        if response.status_code == 200:
+            return orjson.loads(response.content)
+        else:
+            # Try to parse error message
+            error_message = "Login failed"
+            try:
+                error_data = orjson.loads(response.content)
+                error_message = error_data.get("message") or error_data.get("detail") or error_message
+            except:
+                error_message = response.text or f"Login failed with status {response.status_code}"
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                # Try to parse error message
-                error_message = "Login failed"
-                try:
-                    error_data = response.json()
-                    error_message = error_data.get("message") or error_data.get("detail") or error_message
-                except:
-                    error_message = response.text or f"Login failed with status {response.status_code}"
-                
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=error_message
-                )
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=error_message
+            )
     except httpx.RequestError as e:
         raise HTTPException(status_code=503, detail=f"Base44 service unavailable: {str(e)}")
 
@@ -1362,33 +1603,50 @@ async def base44_login(request: Base44LoginRequest):
 async def base44_signup(request: Base44SignupRequest):
     """Proxy signup request to Base44 to avoid CORS issues"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as http_client:
-            response = await http_client.post(
-                f"{BASE44_API_URL}/apps/{BASE44_APP_ID}/auth/signup",
-                json={
-                    "email": request.email,
-                    "password": request.password,
-                    "full_name": request.full_name,
-                    "user_type": request.user_type
-                },
-                headers={
-                    "Content-Type": "application/json",
-                    "X-Base44-App-Id": BASE44_APP_ID
-                }
+        response = await BASE44_HTTP.post(
+            f"/apps/{BASE44_APP_ID}/auth/signup",
+            json={
+                "email": request.email,
+                "password": request.password,
+                "full_name": request.full_name,
+                "user_type": request.user_type
+            },
+            headers=BASE44_HEADERS
+        )
+        
+        if response.status_code == 200:
+            return orjson.loads(response.content)
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=orjson.loads(response.content).get("message", "Signup failed")
             )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=response.json().get("message", "Signup failed")
-                )
     except httpx.RequestError as e:
         raise HTTPException(status_code=503, detail=f"Base44 service unavailable: {str(e)}")
 
 # ==================== MP3 METADATA EXTRACTION ====================
 
+# ~30 sec at 44.1kHz stereo - enough for ACRCloud to identify a track
+ACRCLOUD_SAMPLE_BYTES = 30 * 44100 * 2
+
+def build_multipart_body(boundary: str, fields: dict, file_part: tuple) -> bytes:
+    """
+    Build a multipart/form-data body in a single join.
+    file_part is (field_name, filename, content_type, data).
+    """
+    field_name, filename, content_type, file_data = file_part
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in fields.items()
+    ]
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'.encode()
+    )
+    parts.append(file_data)
+    parts.append(f'\r\n--{boundary}--\r\n'.encode())
+    return b"".join(parts)
+
 async def detect_bpm_with_acrcloud(audio_data: bytes) -> dict:
     """
     Use ACRCloud to detect BPM and other audio features.
@@ -1414,29 +1672,29 @@ async def detect_bpm_with_acrcloud(audio_data: bytes) -> dict:
         
         # Prepare request - send first 30 seconds of audio for faster processing
         # ACRCloud can identify from a small sample
-        sample_size = min(len(audio_data), 30 * 44100 * 2)  # ~30 sec at 44.1kHz stereo
-        audio_sample = audio_data[:sample_size] if len(audio_data) > sample_size else audio_data
-        
-        files = {
-            'sample': ('audio.mp3', BytesIO(audio_sample), 'audio/mpeg')
-        }
+        sample_size = min(len(audio_data), ACRCLOUD_SAMPLE_BYTES)
+        audio_sample = memoryview(audio_data)[:sample_size]
         
         data = {
             'access_key': ACRCLOUD_ACCESS_KEY,
-            'sample_bytes': len(audio_sample),
+            'sample_bytes': sample_size,
             'timestamp': timestamp,
             'signature': signature,
             'data_type': data_type,
             'signature_version': signature_version
         }
         
-        print(f"[ACRCloud BPM] Sending {len(audio_sample)} bytes for analysis...")
+        # Encode the multipart body once ourselves instead of letting httpx re-buffer the sample
+        boundary = uuid.uuid4().hex
+        body = build_multipart_body(boundary, data, ('sample', 'audio.mp3', 'audio/mpeg', audio_sample))
+        
+        print(f"[ACRCloud BPM] Sending {sample_size} bytes for analysis...")
         
         async with httpx.AsyncClient(timeout=30.0) as client:
             response = await client.post(
                 f"https://{ACRCLOUD_HOST}{http_uri}",
-                data=data,
-                files=files
+                content=body,
+                headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
             )
         
         result = response.json()
@@ -1478,6 +1736,25 @@ async def detect_bpm_with_acrcloud(audio_data: bytes) -> dict:
         return {}
 
 
+def _librosa_bpm(path: str) -> Optional[int]:
+    """
+    Detect BPM with librosa. Runs in the CPU process pool, so it must stay
+    at module scope to be picklable.
+    """
+    # Load audio file (first 60 seconds for faster processing)
+    y, sr = librosa.load(path, sr=None, duration=60)
+    # Detect tempo (BPM)
+    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+    if tempo is None:
+        return None
+    # tempo can be an array, get the first value
+    if hasattr(tempo, '__iter__'):
+        bpm_value = float(tempo[0]) if len(tempo) > 0 else float(tempo)
+    else:
+        bpm_value = float(tempo)
+    return int(round(bpm_value))
+
+
 @app.post("/api/extract-mp3-metadata")
 async def extract_mp3_metadata(file: UploadFile = File(...)):
     """Extract metadata from MP3 file including cover art, BPM, genre using ACRCloud"""
@@ -1485,14 +1762,6 @@ async def extract_mp3_metadata(file: UploadFile = File(...)):
         raise HTTPException(status_code=503, detail="MP3 metadata extraction not available")
     
     try:
-        # Read file content
-        content = await file.read()
-        
-        # Save file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
-        
         result = {
             "title": None,
             "artist": None,
@@ -1503,9 +1772,15 @@ async def extract_mp3_metadata(file: UploadFile = File(...)):
             "duration": None,
         }
         
-        try:
+        # Stream the upload to disk in 1 MB chunks so large DJ sets are never held in memory
+        with tempfile.NamedTemporaryFile(suffix='.mp3') as tmp_file:
+            while chunk := await file.read(1 << 20):
+                tmp_file.write(chunk)
+            tmp_file.flush()
+            
             # Try to read MP3 metadata from ID3 tags
-            audio = MP3(tmp_path)
+            tmp_file.seek(0)
+            audio = MP3(tmp_file)
             
             # Get duration
             if audio.info:
@@ -1513,7 +1788,8 @@ async def extract_mp3_metadata(file: UploadFile = File(...)):
             
             # Try ID3 tags first
             try:
-                tags = ID3(tmp_path)
+                tmp_file.seek(0)
+                tags = ID3(tmp_file)
                 
                 # Title
                 if 'TIT2' in tags:
@@ -1540,35 +1816,32 @@ async def extract_mp3_metadata(file: UploadFile = File(...)):
                         pass
                 
                 # Try TXXX frames for custom tags (BPM, genre might be there)
-                for key in tags.keys():
-                    if key.startswith('TXXX'):
-                        frame = tags[key]
-                        desc = frame.desc.lower() if hasattr(frame, 'desc') else ''
-                        if 'bpm' in desc and not result["bpm"]:
-                            try:
-                                result["bpm"] = int(float(str(frame.text[0])))
-                            except:
-                                pass
-                        elif 'genre' in desc and not result["genre"]:
-                            result["genre"] = str(frame.text[0])
+                for frame in tags.getall('TXXX'):
+                    desc = frame.desc.lower()
+                    if 'bpm' in desc and not result["bpm"]:
+                        try:
+                            result["bpm"] = int(float(str(frame.text[0])))
+                        except:
+                            pass
+                    elif 'genre' in desc and not result["genre"]:
+                        result["genre"] = str(frame.text[0])
                 
                 # Cover art
-                for key in tags.keys():
-                    if key.startswith('APIC'):
-                        apic = tags[key]
-                        if apic.data:
-                            # Convert to base64
-                            cover_base64 = base64.b64encode(apic.data).decode('utf-8')
-                            mime_type = apic.mime if hasattr(apic, 'mime') else 'image/jpeg'
-                            result["cover_image"] = f"data:{mime_type};base64,{cover_base64}"
-                            break
+                for apic in tags.getall('APIC'):
+                    if apic.data:
+                        # Convert to base64
+                        cover_base64 = pybase64.b64encode(apic.data).decode('utf-8')
+                        mime_type = apic.mime or 'image/jpeg'
+                        result["cover_image"] = f"data:{mime_type};base64,{cover_base64}"
+                        break
                             
             except Exception as id3_error:
                 print(f"ID3 tags error: {id3_error}")
             
             # Try EasyID3 as fallback for missing fields
             try:
-                easy_tags = EasyID3(tmp_path)
+                tmp_file.seek(0)
+                easy_tags = EasyID3(tmp_file)
                 if not result["title"] and 'title' in easy_tags:
                     result["title"] = str(easy_tags['title'][0])
                 if not result["artist"] and 'artist' in easy_tags:
@@ -1589,7 +1862,9 @@ async def extract_mp3_metadata(file: UploadFile = File(...)):
             # Use ACRCloud if BPM not found in tags - this is more accurate for electronic music
             if result["bpm"] is None:
                 print(f"[MP3 Metadata] BPM not in tags, trying ACRCloud detection...")
-                acr_result = await detect_bpm_with_acrcloud(content)
+                # ACRCloud only needs the first ~30 seconds - read just that from disk
+                tmp_file.seek(0)
+                acr_result = await detect_bpm_with_acrcloud(tmp_file.read(ACRCLOUD_SAMPLE_BYTES))
                 
                 if acr_result.get("bpm"):
                     result["bpm"] = acr_result["bpm"]
@@ -1604,24 +1879,14 @@ async def extract_mp3_metadata(file: UploadFile = File(...)):
             if result["bpm"] is None and LIBROSA_AVAILABLE:
                 try:
                     print(f"[MP3 Metadata] Fallback: Attempting BPM detection with librosa...")
-                    # Load audio file (first 60 seconds for faster processing)
-                    y, sr = librosa.load(tmp_path, sr=None, duration=60)
-                    # Detect tempo (BPM)
-                    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-                    if tempo is not None:
-                        # tempo can be an array, get the first value
-                        if hasattr(tempo, '__iter__'):
-                            bpm_value = float(tempo[0]) if len(tempo) > 0 else float(tempo)
-                        else:
-                            bpm_value = float(tempo)
-                        result["bpm"] = int(round(bpm_value))
+                    bpm_value = await asyncio.get_running_loop().run_in_executor(
+                        app.state.cpu_pool, _librosa_bpm, tmp_file.name
+                    )
+                    if bpm_value is not None:
+                        result["bpm"] = bpm_value
                         print(f"[MP3 Metadata] Librosa detected BPM: {result['bpm']}")
                 except Exception as bpm_error:
                     print(f"[MP3 Metadata] Librosa BPM detection error: {bpm_error}")
-                
-        finally:
-            # Clean up temp file
-            os.unlink(tmp_path)
         
         print(f"[MP3 Metadata] Final result: title={result['title']}, artist={result['artist']}, genre={result['genre']}, bpm={result['bpm']}")
         return result
@@ -1634,23 +1899,17 @@ async def extract_mp3_metadata(file: UploadFile = File(...)):
 async def base44_me(authorization: Optional[str] = Header(None)):
     """Proxy me request to Base44"""
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "X-Base44-App-Id": BASE44_APP_ID
-        }
-        if authorization:
-            headers["Authorization"] = authorization
+        headers = {**BASE44_HEADERS, "Authorization": authorization} if authorization else BASE44_HEADERS
             
-        async with httpx.AsyncClient(timeout=30.0) as http_client:
-            response = await http_client.get(
-                f"{BASE44_API_URL}/apps/{BASE44_APP_ID}/auth/me",
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise HTTPException(status_code=response.status_code, detail="Auth failed")
+        response = await BASE44_HTTP.get(
+            f"/apps/{BASE44_APP_ID}/auth/me",
+            headers=headers
+        )
+        
+        if response.status_code == 200:
+            return base44_passthrough(response)
+        else:
+            raise HTTPException(status_code=response.status_code, detail="Auth failed")
     except httpx.RequestError as e:
         raise HTTPException(status_code=503, detail=f"Base44 service unavailable: {str(e)}")
 
@@ -1674,52 +1933,36 @@ async def base44_list_entities(
 ):
     """Proxy entity list request to Base44"""
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "X-Base44-App-Id": BASE44_APP_ID
-        }
-        if authorization:
-            headers["Authorization"] = authorization
+        headers = {**BASE44_HEADERS, "Authorization": authorization} if authorization else BASE44_HEADERS
         
-        # Build query params
-        params = {"limit": limit}
-        if offset > 0:
-            params["offset"] = offset
-        if sort:
-            params["sort"] = sort
-        if genre:
-            params["genre"] = genre
-        if energy_level:
-            params["energy_level"] = energy_level
-        if is_vip:
-            params["is_vip"] = is_vip
-        if search:
-            params["search"] = search
-        if status:
-            params["status"] = status
-        if uploaded_by:
-            params["uploaded_by"] = uploaded_by
-        if user_id:
-            params["user_id"] = user_id
-        if receiver_id:
-            params["receiver_id"] = receiver_id
-        if sender_id:
-            params["sender_id"] = sender_id
-        if read:
-            params["read"] = read
-            
-        async with httpx.AsyncClient(timeout=30.0) as http_client:
-            response = await http_client.get(
-                f"{BASE44_API_URL}/apps/{BASE44_APP_ID}/entities/{entity_name}",
-                headers=headers,
-                params=params
-            )
+        # Build query params - only forward filters that were actually set
+        optional_params = {
+            "offset": offset if offset > 0 else None,
+            "sort": sort,
+            "genre": genre,
+            "energy_level": energy_level,
+            "is_vip": is_vip,
+            "search": search,
+            "status": status,
+            "uploaded_by": uploaded_by,
+            "user_id": user_id,
+            "receiver_id": receiver_id,
+            "sender_id": sender_id,
+            "read": read,
+        }
+        params = {"limit": limit, **{k: v for k, v in optional_params.items() if v}}
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"Base44 entity error: {response.status_code} - {response.text}")
-                return []
+        response = await BASE44_HTTP.get(
+            f"/apps/{BASE44_APP_ID}/entities/{entity_name}",
+            headers=headers,
+            params=params
+        )
+        
+        if response.status_code == 200:
+            return base44_passthrough(response)
+        else:
+            print(f"Base44 entity error: {response.status_code} - {response.text}")
+            return []
     except httpx.RequestError as e:
         print(f"Base44 request error: {e}")
         return []
@@ -1732,35 +1975,30 @@ async def base44_create_entity(
 ):
     """Proxy entity creation to Base44"""
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "X-Base44-App-Id": BASE44_APP_ID
-        }
-        if authorization:
-            headers["Authorization"] = authorization
+        headers = {**BASE44_HEADERS, "Authorization": authorization} if authorization else BASE44_HEADERS
         
-        print(f"[Base44] Creating entity {entity_name}")
-        print(f"[Base44] Data keys: {list(request_body.keys())}")
+        base44_logger.info("Creating entity %s", entity_name)
+        base44_logger.debug("Data keys: %s", list(request_body))
         
-        async with httpx.AsyncClient(timeout=60.0) as http_client:
-            response = await http_client.post(
-                f"{BASE44_API_URL}/apps/{BASE44_APP_ID}/entities/{entity_name}",
-                headers=headers,
-                json=request_body
+        response = await BASE44_HTTP.post(
+            f"/apps/{BASE44_APP_ID}/entities/{entity_name}",
+            headers=headers,
+            json=request_body,
+            timeout=60.0
+        )
+        
+        base44_logger.debug("Create response: %s", response.status_code)
+        
+        if response.status_code in [200, 201]:
+            return base44_passthrough(response)
+        else:
+            base44_logger.warning("Create error: %s - %.500s", response.status_code, response.text)
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to create entity: {response.text}"
             )
-            
-            print(f"[Base44] Create response: {response.status_code}")
-            
-            if response.status_code in [200, 201]:
-                return response.json()
-            else:
-                print(f"Base44 create error: {response.status_code} - {response.text[:500]}")
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Failed to create entity: {response.text}"
-                )
     except httpx.RequestError as e:
-        print(f"Base44 request error: {e}")
+        base44_logger.warning("Request error: %s", e)
         raise HTTPException(status_code=503, detail=f"Base44 service unavailable: {str(e)}")
 
 @app.put("/api/base44/entities/{entity_name}/{entity_id}")
@@ -1772,32 +2010,31 @@ async def base44_update_entity(
 ):
     """Proxy entity update to Base44"""
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "X-Base44-App-Id": BASE44_APP_ID
-        }
-        if authorization:
-            headers["Authorization"] = authorization
+        headers = {**BASE44_HEADERS, "Authorization": authorization} if authorization else BASE44_HEADERS
         
-        print(f"[Base44] Updating entity {entity_name}/{entity_id}")
+        base44_logger.info("Updating entity %s/%s", entity_name, entity_id)
         
-        async with httpx.AsyncClient(timeout=60.0) as http_client:
-            response = await http_client.put(
-                f"{BASE44_API_URL}/apps/{BASE44_APP_ID}/entities/{entity_name}/{entity_id}",
-                headers=headers,
-                json=request_body
+        response = await BASE44_HTTP.put(
+            f"/apps/{BASE44_APP_ID}/entities/{entity_name}/{entity_id}",
+            headers=headers,
+            json=request_body,
+            timeout=60.0
+        )
+        # The app spends/adds diamonds through this proxy - the award path must
+        # not PUT an older cached balance over it
+        if entity_name == "User" and "black_diamonds" in request_body:
+            BASE44_DIAMONDS_CACHE.pop(entity_id, None)
+        
+        if response.status_code == 200:
+            return base44_passthrough(response)
+        else:
+            base44_logger.warning("Update error: %s - %.500s", response.status_code, response.text)
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to update entity: {response.text}"
             )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"Base44 update error: {response.status_code} - {response.text[:500]}")
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Failed to update entity: {response.text}"
-                )
     except httpx.RequestError as e:
-        print(f"Base44 request error: {e}")
+        base44_logger.warning("Request error: %s", e)
         raise HTTPException(status_code=503, detail=f"Base44 service unavailable: {str(e)}")
 
 @app.post("/api/base44/functions/invoke/{function_name}")
@@ -1810,20 +2047,16 @@ async def base44_invoke_function(
     """Proxy function invocation to Base44"""
     try:
         # Debug: Log all incoming headers
-        print(f"[Base44] Incoming headers: {dict(request.headers)}")
-        print(f"[Base44] Authorization from Header: {authorization}")
+        if base44_logger.isEnabledFor(logging.DEBUG):
+            base44_logger.debug("Incoming headers: %s", dict(request.headers))
+        base44_logger.debug("Authorization from Header: %s", authorization)
         
         # Try to get auth from headers directly if Header() didn't work
         if not authorization:
             authorization = request.headers.get("authorization") or request.headers.get("Authorization")
-            print(f"[Base44] Authorization from request.headers: {authorization}")
+            base44_logger.debug("Authorization from request.headers: %s", authorization)
         
-        headers = {
-            "Content-Type": "application/json",
-            "X-Base44-App-Id": BASE44_APP_ID
-        }
-        if authorization:
-            headers["Authorization"] = authorization
+        headers = {**BASE44_HEADERS, "Authorization": authorization} if authorization else BASE44_HEADERS
         
         # List of functions that use spynners.com domain
         SPYNNERS_FUNCTIONS = [
@@ -1838,43 +2071,56 @@ async def base44_invoke_function(
         # For backend functions, use the app's domain
         if function_name in SPYNNERS_FUNCTIONS:
             # Use spynners.com domain for app functions
-            app_function_url = f"https://spynners.com/api/functions/{function_name}"
-            print(f"[Base44] Calling function URL: {app_function_url}")
-            print(f"[Base44] Request body: {request_body}")
-            print(f"[Base44] Auth header present: {bool(authorization)}")
+            app_function_url = f"{SPYNNERS_APP_FUNCTIONS_URL}/{function_name}"
+            base44_logger.info("Calling function URL: %s", app_function_url)
+            base44_logger.debug("Request body: %s", request_body)
+            base44_logger.debug("Auth header present: %s", bool(authorization))
             
-            async with httpx.AsyncClient(timeout=30.0) as http_client:
-                response = await http_client.post(
-                    app_function_url,
+            try:
+                response = await APP_FUNCTION_HTTP.post(
+                    f"/{function_name}",
                     json=request_body,
                     headers=headers
                 )
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                base44_logger.warning("Function URL unreachable: %s", e)
+                # The request never reached spynners.com, so it is safe to try the standard API.
+                # Read/write errors and read timeouts may have run the function already
+                # (e.g. sendTrackPlayedEmail) and go to the 503 handler below instead.
+            else:
+                base44_logger.debug("Response status: %s (%s)", response.status_code, response.http_version)
                 
-                print(f"[Base44] Response status: {response.status_code}")
+                if response.is_success:
+                    base44_logger.debug("Success! Got response")
+                    return base44_passthrough(response)
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    print(f"[Base44] Success! Got response")
-                    return result
-                else:
-                    print(f"[Base44] Function error: {response.status_code} - {response.text[:500]}")
-                    # Fall through to try standard API
+                base44_logger.warning("Function error: %s - %.500s", response.status_code, response.text)
+                # Bad requests would fail the same way on the platform API - don't retry them.
+                # 401/403/404 can mean the function or auth differs on the app host,
+                # so those fall through like 5xx.
+                if 400 <= response.status_code < 500 and response.status_code not in APP_FUNCTION_FALLTHROUGH_STATUSES:
+                    raise HTTPException(
+                        status_code=response.status_code,
+                        detail=f"Function invocation failed: {response.text}"
+                    )
+                # Otherwise fall through to try standard API
         
         # Standard Base44 function invocation via platform API
-        async with httpx.AsyncClient(timeout=30.0) as http_client:
-            response = await http_client.post(
-                f"{BASE44_API_URL}/apps/{BASE44_APP_ID}/functions/invoke/{function_name}",
-                json=request_body,
-                headers=headers
+        response = await BASE44_HTTP.post(
+            f"/apps/{BASE44_APP_ID}/functions/invoke/{function_name}",
+            json=request_body,
+            headers=headers
+        )
+        # httpx falls back to HTTP/1.1 silently if h2 isn't negotiated
+        base44_logger.debug("Platform API response: %s (%s)", response.status_code, response.http_version)
+        
+        if response.is_success:
+            return base44_passthrough(response)
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Function invocation failed: {response.text}"
             )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Function invocation failed: {response.text}"
-                )
     except httpx.RequestError as e:
         raise HTTPException(status_code=503, detail=f"Base44 service unavailable: {str(e)}")
 
@@ -1887,84 +2133,182 @@ class AwardDiamondRequest(BaseModel):
     reason: str = "spyn_session"
     session_id: Optional[str] = None
 
-@app.post("/api/award-diamond")
-async def award_diamond(request: AwardDiamondRequest, authorization: Optional[str] = Header(None)):
+# Last known black_diamonds per user for the award GET+PUT, so repeat awards skip the GET.
+# Per process - each uvicorn worker has its own copy - so every endpoint that writes
+# black_diamonds must evict the user here, and the short TTL bounds cross-worker staleness.
+BASE44_DIAMONDS_CACHE = TTLCache(maxsize=10000, ttl=60)
+
+async def increment_base44_diamonds(user_id: str, authorization: str, amount: int = 1):
     """
-    Award a diamond to a user for completing a SPYN session.
-    Only one black diamond per day can be earned.
+    Add black diamonds to a user in Base44 with a GET+PUT on the pooled client.
+    giveBlackDiamonds is not used: it is the admin grant (see admin_add_diamonds),
+    expects the user's email, and isn't known to accept a regular user's token.
     """
-    try:
-        user_id = request.user_id
-        today = datetime.utcnow().strftime("%Y-%m-%d")
-        
-        # Check if user already earned a diamond today
-        existing_award = db["diamond_awards"].find_one({
-            "user_id": user_id,
-            "type": request.type,
-            "date": today
-        })
-        
-        if existing_award:
-            return {
-                "success": False,
-                "message": "Already earned a diamond today",
-                "already_awarded": True
-            }
+    headers = {**BASE44_HEADERS, "Authorization": authorization}
+    user_path = USER_ENTITY_PATH_TPL.format(user_id)
+    
+    # Get current user data to increment diamonds (unless we saw it recently)
+    current_diamonds = BASE44_DIAMONDS_CACHE.get(user_id)
+    if current_diamonds is None:
+        user_response = await BASE44_HTTP.get(user_path, headers=headers)
+        if user_response.status_code != 200:
+            return
+        user_data = orjson.loads(user_response.content)
+        current_diamonds = user_data.get("black_diamonds", 0)
+    
+    # Update with incremented diamonds
+    put_response = await BASE44_HTTP.put(
+        user_path,
+        headers=headers,
+        json={"black_diamonds": current_diamonds + amount}
+    )
+    if put_response.status_code == 200:
+        BASE44_DIAMONDS_CACHE[user_id] = current_diamonds + amount
+    elif 400 <= put_response.status_code < 500:
+        BASE44_DIAMONDS_CACHE.pop(user_id, None)
+
+# Current UTC date, recomputed only when the day rolls over
+_TODAY_CACHE = {"until": 0.0, "date": "", "date_int": 0}
+
+def _refresh_today():
+    now = time.time()
+    if now >= _TODAY_CACHE["until"]:
+        today = datetime.utcfromtimestamp(now)
+        _TODAY_CACHE["date"] = today.strftime("%Y-%m-%d")
+        _TODAY_CACHE["date_int"] = today.year * 10000 + today.month * 100 + today.day
+        _TODAY_CACHE["until"] = (now // 86400 + 1) * 86400
+
+def today_utc() -> str:
+    _refresh_today()
+    return _TODAY_CACHE["date"]
+
+def today_utc_int() -> int:
+    """Today as YYYYMMDD, e.g. 20250115 - stored as a BSON int32 in award docs."""
+    _refresh_today()
+    return _TODAY_CACHE["date_int"]
+
+# Base44 diamond updates are queued as (user_id, authorization, amount) and
+# applied by a few consumer tasks, so award_diamond only waits on the Mongo insert.
+# Each consumer owns one queue and a user always maps to the same queue, so two
+# GET+PUTs for one user never run at once in this process.
+AWARD_CONSUMERS = 4
+AWARD_QUEUES = [asyncio.Queue(maxsize=2_500) for _ in range(AWARD_CONSUMERS)]
+AWARD_MAX_BATCH = 32
+AWARD_COALESCE_SECONDS = 0.02
+AWARD_DRAIN_SECONDS = 10
+
+def award_queue_for(user_id: str) -> asyncio.Queue:
+    return AWARD_QUEUES[hash(user_id) % AWARD_CONSUMERS]
+
+async def _award_consumer(queue: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        # Collect whatever else arrives within the coalescing window
+        deadline = loop.time() + AWARD_COALESCE_SECONDS
+        while len(batch) < AWARD_MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
         
-        # Record the diamond award
-        award = {
-            "user_id": user_id,
-            "type": request.type,
-            "reason": request.reason,
-            "session_id": request.session_id,
-            "date": today,
-            "awarded_at": datetime.utcnow().isoformat()
-        }
-        db["diamond_awards"].insert_one(award)
+        # One increment per user: sum the amounts, keep the latest token
+        per_user = {}
+        for user_id, authorization, amount in batch:
+            _, total = per_user.get(user_id, (None, 0))
+            per_user[user_id] = (authorization, total + amount)
         
-        # Update user's diamond count in Base44
-        if authorization:
+        for user_id, (authorization, amount) in per_user.items():
             try:
-                headers = {
-                    "Content-Type": "application/json",
-                    "X-Base44-App-Id": BASE44_APP_ID,
-                    "Authorization": authorization
-                }
-                
-                # Get current user data to increment diamonds
-                async with httpx.AsyncClient(timeout=30.0) as http_client:
-                    # Try to update user's diamonds in Base44
-                    user_response = await http_client.get(
-                        f"{BASE44_API_URL}/apps/{BASE44_APP_ID}/entities/User/{user_id}",
-                        headers=headers
-                    )
-                    
-                    if user_response.status_code == 200:
-                        user_data = user_response.json()
-                        current_diamonds = user_data.get("black_diamonds", 0)
-                        
-                        # Update with incremented diamonds
-                        await http_client.put(
-                            f"{BASE44_API_URL}/apps/{BASE44_APP_ID}/entities/User/{user_id}",
-                            headers=headers,
-                            json={"black_diamonds": current_diamonds + 1}
-                        )
+                await increment_base44_diamonds(user_id, authorization, amount)
             except Exception as e:
                 print(f"Could not update user diamonds in Base44: {e}")
-        
+        for _ in batch:
+            queue.task_done()
+
+@app.on_event("startup")
+async def startup_award_consumers():
+    app.state.award_consumers = [
+        asyncio.create_task(_award_consumer(queue)) for queue in AWARD_QUEUES
+    ]
+
+async def shutdown_award_consumers():
+    """Called from shutdown_base44_clients, before the clients the consumers use are closed."""
+    # Awards are already recorded in Mongo, so a dropped update would never be retried
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(queue.join() for queue in AWARD_QUEUES)),
+            timeout=AWARD_DRAIN_SECONDS
+        )
+    except asyncio.TimeoutError:
+        pending = sum(queue.qsize() for queue in AWARD_QUEUES)
+        print(f"[Diamonds] Shutdown drain timed out, {pending} Base44 updates dropped")
+    for task in app.state.award_consumers:
+        task.cancel()
+    await asyncio.gather(*app.state.award_consumers, return_exceptions=True)
+
+@app.post("/api/award-diamond")
+async def award_diamond(request: AwardDiamondRequest, authorization: Optional[str] = Header(None)):
+    """
+    Award a diamond to a user for completing a SPYN session.
+    Only one black diamond per day can be earned.
+    """
+    user_id = request.user_id
+    today = today_utc()
+    
+    # Without the unique index nothing stops a second award on the same day
+    if not DIAMOND_AWARD_INDEX["ready"]:
+        try:
+            await diamond_awards_collection.create_index(DIAMOND_AWARD_INDEX_KEYS, unique=True)
+            DIAMOND_AWARD_INDEX["ready"] = True
+        except PyMongoError as e:
+            print(f"Award diamond error: unique index unavailable: {e}")
+            raise HTTPException(status_code=503, detail="Diamond awards are temporarily unavailable")
+    
+    # Record the diamond award - the unique (user_id, type, date) index rejects
+    # a second award for the same day, so no separate lookup is needed.
+    # date is an int (YYYYMMDD) and awarded_at a native BSON date, both
+    # smaller and cheaper to compare than strings.
+    award = {
+        "user_id": user_id,
+        "type": request.type,
+        "reason": request.reason,
+        "session_id": request.session_id,
+        "date": today_utc_int(),
+        "awarded_at": datetime.utcnow()
+    }
+    try:
+        await diamond_awards_collection.insert_one(award)
+    except DuplicateKeyError:
         return {
-            "success": True,
-            "message": "Diamond awarded!",
-            "type": request.type,
-            "date": today
+            "success": False,
+            "message": "Already earned a diamond today",
+            "already_awarded": True
         }
-        
-    except Exception as e:
+    except PyMongoError as e:
         print(f"Award diamond error: {e}")
         return {
             "success": False,
             "message": f"Failed to award diamond: {str(e)}"
         }
+    
+    # Update user's diamond count in Base44 - best effort, not awaited.
+    # Failures are logged by the award consumers.
+    if authorization:
+        try:
+            award_queue_for(user_id).put_nowait((user_id, authorization, 1))
+        except asyncio.QueueFull:
+            print(f"[Diamonds] Award queue full, skipping Base44 update for {user_id}")
+    
+    return {
+        "success": True,
+        "message": "Diamond awarded!",
+        "type": request.type,
+        "date": today
+    }
 
 
 # ==================== OFFLINE SPYN PROCESSING ====================
@@ -2280,10 +2624,9 @@ async def call_spynners_function(function_name: str, body: dict, authorization:
         print(f"[Spynners API] Response status: {response.status_code}")
         
         if response.status_code == 200:
-            data = response.json()
-            # Log a preview of the response
-            data_str = str(data)[:500]
-            print(f"[Spynners API] Response preview: {data_str}")
+            # Parse straight from bytes and preview the raw body, not str(data)
+            data = orjson.loads(response.content)
+            print(f"[Spynners API] Response preview: {response.content[:500].decode(errors='replace')}")
             return data
         else:
             print(f"[Spynners API] Error: {response.text}")
@@ -2888,6 +3231,8 @@ async def update_user_diamonds(request: UpdateDiamondsRequest, authorization: st
             {"black_diamonds": new_balance}, 
             authorization
         )
+        # The award GET+PUT must not write an older cached balance over this one
+        BASE44_DIAMONDS_CACHE.pop(request.user_id, None)
         
         print(f"[Diamonds] Spynners update result: {update_result}")
         
@@ -2993,6 +3338,8 @@ async def admin_add_diamonds(request: AdminAddDiamondsRequest, authorization: st
         print(f"[Admin Diamonds] Calling giveBlackDiamonds with: {body}")
         
         result = await call_spynners_function("giveBlackDiamonds", body, authorization)
+        # The award GET+PUT must not write an older cached balance over this grant
+        BASE44_DIAMONDS_CACHE.pop(request.user_id, None)
         
         print(f"[Admin Diamonds] Result: {result}")
         
@@ -6219,16 +6566,23 @@ async def serve_uploaded_file(filename: str, request: Request):
 
 # ==================== HEALTH CHECK ====================
 
+# Everything except the timestamp is fixed for the life of the process,
+# so the JSON body is pre-encoded and only the timestamp is spliced in
+HEALTH_STATIC = {
+    "status": "healthy",
+    "service": "SPYNNERS API",
+    "version": "1.0.0",
+    "acrcloud_configured": bool(ACRCLOUD_ACCESS_KEY and ACRCLOUD_ACCESS_SECRET),
+}
+HEALTH_PREFIX = orjson.dumps(HEALTH_STATIC)[:-1] + b',"timestamp":'
+
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
-    return {
-        "status": "healthy",
-        "service": "SPYNNERS API",
-        "version": "1.0.0",
-        "acrcloud_configured": bool(ACRCLOUD_ACCESS_KEY and ACRCLOUD_ACCESS_SECRET),
-        "timestamp": datetime.utcnow().isoformat()
-    }
+    return Response(
+        content=HEALTH_PREFIX + repr(time.time()).encode() + b"}",
+        media_type="application/json"
+    )
 
 @app.get("/api/download-project")
 async def download_project():
@@ -6289,4 +6643,18 @@ async def root():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # Import string so uvicorn can fork workers; each worker builds its own
+    # httpx clients and pools in the startup hooks. WEB_CONCURRENCY is the
+    # same variable gunicorn/uvicorn use for the worker count; it is exported so
+    # the spawned workers size their CPU pools for the same count.
+    workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    uvicorn.run(
+        "server:app",
+        host="0.0.0.0",
+        port=8001,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+        log_level="warning",
+    )
@@ -5,22 +5,33 @@ Tests critical APIs as specified in the review request before iOS native build
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import json
+import orjson
 import sys
 import os
 import base64
+import functools
+import pathlib
+import re
+import time
 from datetime import datetime
 
-# Get backend URL from frontend .env file
+DEFAULT_BACKEND_URL = "https://spynner-stable.preview.emergentagent.com"
+
+# Get backend URL from frontend .env file (read once per process)
+@functools.lru_cache(maxsize=1)
 def get_backend_url():
     try:
-        with open('/app/frontend/.env', 'r') as f:
-            for line in f:
-                if line.startswith('EXPO_PUBLIC_BACKEND_URL='):
-                    return line.split('=', 1)[1].strip()
-    except:
-        pass
-    return "https://spynner-stable.preview.emergentagent.com"
+        env = pathlib.Path('/app/frontend/.env').read_text()
+    except OSError:
+        return DEFAULT_BACKEND_URL
+    match = re.search(r'^EXPO_PUBLIC_BACKEND_URL=(.+)$', env, re.M)
+    return match.group(1).strip() if match else DEFAULT_BACKEND_URL
 
 BASE_URL = get_backend_url()
 API_URL = f"{BASE_URL}/api"
@@ -29,35 +40,106 @@ API_URL = f"{BASE_URL}/api"
 TEST_EMAIL = "djbenjaminfranklin@gmail.com"
 TEST_PASSWORD = "Elsamila1979"
 
-print(f"🚀 SPYNNERS iOS Native Build - Critical API Testing")
-print(f"📡 Backend URL: {API_URL}")
-print(f"🔑 Test Credentials: {TEST_EMAIL}")
-print("=" * 60)
+# Output is buffered and written in one go at exit; --verbose streams it live instead
+VERBOSE = "--verbose" in sys.argv
+_LOG_BUFFER = []
+
+def out(line=""):
+    if VERBOSE:
+        print(line)
+    else:
+        _LOG_BUFFER.append(f"{line}\n")
+
+def flush_output():
+    sys.stdout.write("".join(_LOG_BUFFER))
+    sys.stdout.flush()
+    _LOG_BUFFER.clear()
+
+atexit.register(flush_output)
+
+out(f"🚀 SPYNNERS iOS Native Build - Critical API Testing")
+out(f"📡 Backend URL: {API_URL}")
+out(f"🔑 Test Credentials: {TEST_EMAIL}")
+out("=" * 60)
+
+# Static dummy audio payloads - encoded once, the endpoints only need to accept them
+DUMMY_AUDIO_B64 = base64.b64encode(b"dummy_audio_for_testing_endpoint").decode()
+DUMMY_SEG1_B64 = base64.b64encode(b"dummy_audio_segment_1").decode()
+DUMMY_SEG2_B64 = base64.b64encode(b"dummy_audio_segment_2").decode()
+
+# Request bodies that never change during a run, serialized once. They are
+# sent with data= and rely on the session's JSON Content-Type header.
+LOGIN_BODY = orjson.dumps({"email": TEST_EMAIL, "password": TEST_PASSWORD})
+PDF_BODY = orjson.dumps({"start_date": None, "end_date": None})
+RECOGNIZE_BODY = orjson.dumps({"audio_base64": DUMMY_AUDIO_B64})
+CONCAT_BODY = orjson.dumps({
+    "audio_segments": [DUMMY_SEG1_B64, DUMMY_SEG2_B64],
+    "output_format": "m4a"
+})
+
+# One pooled session for every test so connections (and TLS) are reused
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    # Transient gateway errors and rate limits are retried with exponential backoff.
+    # raise_on_status=False: a persistent 5xx still comes back as a response,
+    # so tests report "HTTP 502" rather than a RetryError
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "POST"]),
+        raise_on_status=False
+    )
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+SESSION.headers.update({"Content-Type": "application/json"})
+atexit.register(SESSION.close)
+
+# Results are stamped with time.monotonic_ns(); wall-clock ISO strings are
+# derived from this baseline only when the report is written
+RUN_STARTED = time.time()
+RUN_STARTED_NS = time.monotonic_ns()
+
+def iso_from_ns(timestamp_ns):
+    return datetime.fromtimestamp(RUN_STARTED + (timestamp_ns - RUN_STARTED_NS) / 1e9).isoformat()
 
 # Test results tracking
 test_results = []
 failed_tests = []
 auth_token = None
+# Body of the successful login, reused by later checks instead of logging in again
+AUTH_RESPONSE = None
+# Phase 2 tests run on a thread pool; guards the shared lists and keeps each result's output together
+_results_lock = threading.Lock()
+
+def _snip(data, n=512):
+    """Cap a stored response body at n characters"""
+    text = data if isinstance(data, str) else orjson.dumps(data, default=str).decode()
+    return text[:n] + ("…" if len(text) > n else "")
 
 def log_test(test_name, success, details="", response_data=None):
     """Log test result with enhanced details"""
     status = "✅ PASS" if success else "❌ FAIL"
-    print(f"{status} {test_name}")
-    if details:
-        print(f"    {details}")
-    if response_data and not success:
-        print(f"    Response: {json.dumps(response_data, indent=2)[:200]}...")
-    
-    test_results.append({
-        "test": test_name,
-        "success": success,
-        "details": details,
-        "response_data": response_data,
-        "timestamp": datetime.now().isoformat()
-    })
-    
-    if not success:
-        failed_tests.append(test_name)
+    with _results_lock:
+        out(f"{status} {test_name}")
+        if details:
+            out(f"    {details}")
+        if response_data and not success:
+            out(f"    Response: {orjson.dumps(response_data, option=orjson.OPT_INDENT_2).decode()[:200]}...")
+        
+        test_results.append({
+            "test": test_name,
+            "success": success,
+            "details": details,
+            "response_data": _snip(response_data) if response_data is not None else None,
+            "timestamp_ns": time.monotonic_ns()
+        })
+        
+        if not success:
+            failed_tests.append(test_name)
 
 def test_authentication():
     """
@@ -65,34 +147,29 @@ def test_authentication():
     Credentials: djbenjaminfranklin@gmail.com / Elsamila1979
     Verify that token is returned
     """
-    global auth_token
+    global auth_token, AUTH_RESPONSE
     try:
-        login_data = {
-            "email": TEST_EMAIL,
-            "password": TEST_PASSWORD
-        }
-        
         # Try Base44 login first (primary method)
-        response = requests.post(
+        response = SESSION.post(
             f"{API_URL}/base44/auth/login",
-            json=login_data,
-            headers={"Content-Type": "application/json"},
+            data=LOGIN_BODY,
             timeout=30
         )
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             # Check for both 'token' and 'access_token' fields
             token = data.get("token") or data.get("access_token")
             if token:
                 auth_token = token
-                # Check black diamonds as mentioned in test_result.md
-                black_diamonds = data.get("user", {}).get("data", {}).get("black_diamonds", 0)
+                AUTH_RESPONSE = data
+                # Every later request on the session carries the token
+                SESSION.headers["Authorization"] = f"Bearer {auth_token}"
                 log_test(
                     "1. Authentication (Base44)", 
                     True, 
-                    f"✅ Token received. Black diamonds: {black_diamonds}",
-                    {"has_token": True, "black_diamonds": black_diamonds, "token_type": "access_token" if data.get("access_token") else "token"}
+                    "✅ Token received",
+                    {"has_token": True, "token_type": "access_token" if data.get("access_token") else "token"}
                 )
                 return True
             else:
@@ -100,16 +177,18 @@ def test_authentication():
                 return False
         else:
             # Try local fallback
-            response = requests.post(
+            response = SESSION.post(
                 f"{API_URL}/auth/local/login",
-                json=login_data,
+                data=LOGIN_BODY,
                 timeout=10
             )
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 token = data.get("token") or data.get("access_token")
                 if token:
                     auth_token = token
+                    AUTH_RESPONSE = data
+                    SESSION.headers["Authorization"] = f"Bearer {auth_token}"
                     log_test("1. Authentication (Local Fallback)", True, "✅ Token received (local)", data)
                     return True
             
@@ -120,6 +199,24 @@ def test_authentication():
         log_test("1. Authentication", False, f"Request failed: {str(e)}")
         return False
 
+def test_black_diamonds_login():
+    """
+    Test 1b: Black diamonds returned with the login response
+    Reads the cached login body - no extra request
+    """
+    if AUTH_RESPONSE is None:
+        log_test("1b. Black Diamonds (Login)", False, "No login response to inspect")
+        return False
+    
+    # Check black diamonds as mentioned in test_result.md
+    black_diamonds = (AUTH_RESPONSE.get("user") or {}).get("data", {}).get("black_diamonds")
+    if isinstance(black_diamonds, int):
+        log_test("1b. Black Diamonds (Login)", True, f"✅ Black diamonds: {black_diamonds}", {"black_diamonds": black_diamonds})
+        return True
+    
+    log_test("1b. Black Diamonds (Login)", False, "black_diamonds missing from login response", AUTH_RESPONSE.get("user"))
+    return False
+
 def test_tracks_api():
     """
     Test 2: Tracks - GET /api/base44/entities/Track?limit=10
@@ -127,10 +224,10 @@ def test_tracks_api():
     """
     try:
         # Test local tracks endpoint (Base44 proxy not implemented in backend)
-        response = requests.get(f"{API_URL}/tracks?limit=10", timeout=15)
+        response = SESSION.get(f"{API_URL}/tracks?limit=10", timeout=15)
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             if data.get("success") and "tracks" in data:
                 tracks = data["tracks"]
                 # Verify track structure
@@ -170,13 +267,13 @@ def test_track_send_api():
     try:
         # This is a Base44 entity, not implemented in local backend
         # Test if endpoint exists or returns appropriate error
-        response = requests.get(f"{API_URL}/track-send?limit=5", timeout=10)
+        response = SESSION.get(f"{API_URL}/track-send?limit=5", timeout=10)
         
         if response.status_code == 404:
             log_test("3. TrackSend API", True, "✅ Entity not implemented locally (expected for Base44 entity)", "404 - Expected")
             return True
         elif response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             log_test("3. TrackSend API", True, "✅ TrackSend endpoint accessible", data)
             return True
         else:
@@ -194,16 +291,12 @@ def test_admin_downloads():
     - POST /api/admin/downloads/pdf with {"start_date": null, "end_date": null}
     """
     try:
-        headers = {}
-        if auth_token:
-            headers["Authorization"] = f"Bearer {auth_token}"
-        
         # Test GET /api/admin/downloads
-        response = requests.get(f"{API_URL}/admin/downloads", headers=headers, timeout=10)
+        response = SESSION.get(f"{API_URL}/admin/downloads", timeout=10)
         
         get_success = False
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             log_test("4a. Admin Downloads (GET)", True, "✅ Download stats retrieved", data)
             get_success = True
         elif response.status_code == 404:
@@ -213,24 +306,24 @@ def test_admin_downloads():
             log_test("4a. Admin Downloads (GET)", False, f"HTTP {response.status_code}", response.text)
         
         # Test POST /api/admin/downloads/pdf
-        pdf_data = {"start_date": None, "end_date": None}
-        response = requests.post(
+        # Streamed so a successful PDF is never read into memory - only its headers matter
+        with SESSION.post(
             f"{API_URL}/admin/downloads/pdf",
-            json=pdf_data,
-            headers={**headers, "Content-Type": "application/json"},
-            timeout=30
-        )
-        
-        pdf_success = False
-        if response.status_code == 200:
-            content_type = response.headers.get("content-type", "")
-            log_test("4b. Admin Downloads (PDF)", True, f"✅ PDF generated. Content-Type: {content_type}", {"size": len(response.content)})
-            pdf_success = True
-        elif response.status_code == 404:
-            log_test("4b. Admin Downloads (PDF)", True, "✅ PDF endpoint not implemented (expected)", "404 - Not Found")
-            pdf_success = True
-        else:
-            log_test("4b. Admin Downloads (PDF)", False, f"HTTP {response.status_code}", response.text)
+            data=PDF_BODY,
+            timeout=30,
+            stream=True
+        ) as response:
+            pdf_success = False
+            if response.status_code == 200:
+                content_type = response.headers.get("content-type", "")
+                size = response.headers.get("content-length")
+                log_test("4b. Admin Downloads (PDF)", True, f"✅ PDF generated. Content-Type: {content_type}", {"size": size})
+                pdf_success = True
+            elif response.status_code == 404:
+                log_test("4b. Admin Downloads (PDF)", True, "✅ PDF endpoint not implemented (expected)", "404 - Not Found")
+                pdf_success = True
+            else:
+                log_test("4b. Admin Downloads (PDF)", False, f"HTTP {response.status_code}", response.text)
         
         return get_success and pdf_success
             
@@ -244,26 +337,15 @@ def test_audio_recognition():
     Verify function exists (can return error without audio, that's OK)
     """
     try:
-        headers = {"Content-Type": "application/json"}
-        if auth_token:
-            headers["Authorization"] = f"Bearer {auth_token}"
-        
-        # Test local audio recognition endpoint
-        # Create minimal dummy audio data
-        dummy_audio = b"dummy_audio_for_testing_endpoint"
-        audio_base64 = base64.b64encode(dummy_audio).decode()
-        
-        recognition_data = {"audio_base64": audio_base64}
-        
-        response = requests.post(
+        # Test local audio recognition endpoint with minimal dummy audio data
+        response = SESSION.post(
             f"{API_URL}/recognize-audio",
-            json=recognition_data,
-            headers=headers,
+            data=RECOGNIZE_BODY,
             timeout=30
         )
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             log_test("5. Audio Recognition", True, "✅ Audio recognition endpoint accessible", data)
             return True
         elif response.status_code in [500, 503]:
@@ -283,65 +365,68 @@ def test_audio_recognition():
         log_test("5. Audio Recognition", False, f"Request failed: {str(e)}")
         return False
 
-def test_nearby_places():
+# (label, lat, lng) - each case runs as its own test. The check_ helper takes
+# arguments, so it must not look like a test_ function to pytest collection.
+NEARBY_PLACES_CASES = [
+    ("Málaga", 36.5, -4.9),
+    ("Paris", 48.8566, 2.3522),
+]
+
+def check_nearby_places(label, lat, lng):
     """
-    Test 6: Places - POST /api/base44/functions/invoke/getNearbyPlaces
-    Body: {"latitude": 36.5, "longitude": -4.9, "radius": 1000}
+    Test 6: Places - GET /api/places/nearby
+    Params: {"lat": lat, "lng": lng, "radius": 1000}
     """
+    test_name = f"6. Nearby Places ({label})"
     try:
         # Test local nearby places endpoint
         params = {
-            "lat": 36.5,
-            "lng": -4.9,
+            "lat": lat,
+            "lng": lng,
             "radius": 1000
         }
         
-        response = requests.get(f"{API_URL}/places/nearby", params=params, timeout=15)
+        response = SESSION.get(f"{API_URL}/places/nearby", params=params, timeout=15)
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             if data.get("success") and "places" in data:
                 places = data["places"]
                 is_mock = data.get("mock", False)
                 status_msg = f"✅ Found {len(places)} places"
                 if is_mock:
                     status_msg += " (MOCKED - no Google API key)"
-                log_test("6. Nearby Places", True, status_msg, {"places_count": len(places), "mock": is_mock})
+                log_test(test_name, True, status_msg, {"places_count": len(places), "mock": is_mock})
                 return True
             else:
-                log_test("6. Nearby Places", False, "Invalid response format", data)
+                log_test(test_name, False, "Invalid response format", data)
                 return False
         else:
-            log_test("6. Nearby Places", False, f"HTTP {response.status_code}", response.text)
+            log_test(test_name, False, f"HTTP {response.status_code}", response.text)
             return False
             
     except Exception as e:
-        log_test("6. Nearby Places", False, f"Request failed: {str(e)}")
+        log_test(test_name, False, f"Request failed: {str(e)}")
         return False
 
+def test_nearby_places():
+    """Test 6: Places - every case in NEARBY_PLACES_CASES (the runner schedules them individually)"""
+    return all([check_nearby_places(label, lat, lng) for label, lat, lng in NEARBY_PLACES_CASES])
+
 def test_audio_concatenation():
     """
     Test 7: Audio Concatenation - Verify /api/concatenate-audio exists
     """
     try:
-        # Create minimal dummy audio segments
-        dummy_segment1 = base64.b64encode(b"dummy_audio_segment_1").decode()
-        dummy_segment2 = base64.b64encode(b"dummy_audio_segment_2").decode()
-        
-        concat_data = {
-            "audio_segments": [dummy_segment1, dummy_segment2],
-            "output_format": "m4a"
-        }
-        
-        response = requests.post(
+        # Minimal dummy audio segments
+        response = SESSION.post(
             f"{API_URL}/concatenate-audio",
-            json=concat_data,
-            headers={"Content-Type": "application/json"},
+            data=CONCAT_BODY,
             timeout=30
         )
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             log_test("7. Audio Concatenation", True, "✅ Audio concatenation endpoint accessible", data)
             return True
         elif response.status_code == 500:
@@ -363,42 +448,54 @@ def test_audio_concatenation():
 
 def run_all_tests():
     """Run all critical API tests for iOS native build preparation"""
-    print("🧪 Running Critical API Tests for iOS Native Build...")
-    print()
+    out("🧪 Running Critical API Tests for iOS Native Build...")
+    out()
     
-    # Critical tests in order of importance
-    tests = [
+    # Phase 1 runs first and in order - later tests use the auth token it sets
+    phase1 = [
         ("Authentication", test_authentication),
+    ]
+    # Phase 2 tests are independent of each other and run concurrently.
+    # The slow 30s-timeout POSTs (audio upload/processing) are listed first so
+    # they are in flight from the start instead of queueing behind quick GETs.
+    phase2 = [
+        ("Audio Recognition", test_audio_recognition),
+        ("Audio Concatenation", test_audio_concatenation),
+        ("Admin Downloads", test_admin_downloads),
+        ("Black Diamonds", test_black_diamonds_login),
         ("Tracks API", test_tracks_api),
         ("TrackSend API", test_track_send_api),
-        ("Admin Downloads", test_admin_downloads),
-        ("Audio Recognition", test_audio_recognition),
-        ("Nearby Places", test_nearby_places),
-        ("Audio Concatenation", test_audio_concatenation)
+        *[(f"Nearby Places ({label})", functools.partial(check_nearby_places, label, lat, lng))
+          for label, lat, lng in NEARBY_PLACES_CASES]
     ]
     
-    passed = 0
-    total = len(tests)
-    
-    for test_name, test_func in tests:
+    def run_test(test_name, test_func):
         try:
-            print(f"🔍 Testing: {test_name}")
-            if test_func():
-                passed += 1
-            print()
+            return bool(test_func())
         except Exception as e:
             log_test(f"{test_name} (CRASHED)", False, f"Test crashed: {str(e)}")
-            print(f"💥 Test {test_name} crashed: {str(e)}")
-            print()
+            return False
+    
+    total = len(phase1) + len(phase2)
+    
+    out(f"🔍 Phase 1: {', '.join(name for name, _ in phase1)}")
+    passed = sum(run_test(name, func) for name, func in phase1)
+    out()
+    
+    # Stays within the session's pool_maxsize so every worker keeps its connection
+    out(f"🔍 Phase 2: {', '.join(name for name, _ in phase2)}")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        passed += sum(pool.map(lambda test: run_test(*test), phase2))
+    out()
     
     # Summary Report
-    print("=" * 60)
-    print("📊 CRITICAL API TEST SUMMARY FOR iOS NATIVE BUILD")
-    print("=" * 60)
+    out("=" * 60)
+    out("📊 CRITICAL API TEST SUMMARY FOR iOS NATIVE BUILD")
+    out("=" * 60)
     
     success_rate = (passed / total) * 100
-    print(f"✅ Passed: {passed}/{total} ({success_rate:.1f}%)")
-    print(f"❌ Failed: {len(failed_tests)}")
+    out(f"✅ Passed: {passed}/{total} ({success_rate:.1f}%)")
+    out(f"❌ Failed: {len(failed_tests)}")
     
     # Show critical issues
     critical_failures = []
@@ -407,40 +504,40 @@ def run_all_tests():
             critical_failures.append(result)
     
     if critical_failures:
-        print("\n🚨 CRITICAL FAILURES (May block iOS build):")
+        out("\n🚨 CRITICAL FAILURES (May block iOS build):")
         for failure in critical_failures:
-            print(f"   • {failure['test']}: {failure['details']}")
+            out(f"   • {failure['test']}: {failure['details']}")
     
     # Show all failures
     if failed_tests:
-        print(f"\n❌ ALL FAILED TESTS:")
+        out(f"\n❌ ALL FAILED TESTS:")
         for test in failed_tests:
-            print(f"   • {test}")
+            out(f"   • {test}")
     
     # Backend stability assessment
-    print(f"\n🏗️ BACKEND STABILITY ASSESSMENT:")
-    if passed >= 5:  # At least 5/7 tests pass
-        print("   ✅ Backend is STABLE for iOS native build")
+    out(f"\n🏗️ BACKEND STABILITY ASSESSMENT:")
+    if passed >= 5:  # At least 5/9 tests pass
+        out("   ✅ Backend is STABLE for iOS native build")
     elif passed >= 3:
-        print("   ⚠️  Backend has MINOR ISSUES but may proceed with caution")
+        out("   ⚠️  Backend has MINOR ISSUES but may proceed with caution")
     else:
-        print("   🚨 Backend has MAJOR ISSUES - iOS build NOT recommended")
+        out("   🚨 Backend has MAJOR ISSUES - iOS build NOT recommended")
     
     # Base44 proxy status
     base44_working = any("Base44" in result["test"] and result["success"] for result in test_results)
-    print(f"   📡 Base44 Proxy Status: {'✅ Working' if base44_working else '❌ Issues detected'}")
+    out(f"   📡 Base44 Proxy Status: {'✅ Working' if base44_working else '❌ Issues detected'}")
     
     # Data accessibility
     tracks_working = any("Tracks" in result["test"] and result["success"] for result in test_results)
-    print(f"   💾 Data Accessibility: {'✅ Working' if tracks_working else '❌ Issues detected'}")
+    out(f"   💾 Data Accessibility: {'✅ Working' if tracks_working else '❌ Issues detected'}")
     
     # Cloud functions
     audio_working = any("Audio" in result["test"] and result["success"] for result in test_results)
     places_working = any("Places" in result["test"] and result["success"] for result in test_results)
     cloud_functions_ok = audio_working and places_working
-    print(f"   ☁️  Cloud Functions: {'✅ Working' if cloud_functions_ok else '❌ Issues detected'}")
+    out(f"   ☁️  Cloud Functions: {'✅ Working' if cloud_functions_ok else '❌ Issues detected'}")
     
-    print("\n" + "=" * 60)
+    out("\n" + "=" * 60)
     
     return passed == total
 
@@ -459,11 +556,11 @@ if __name__ == "__main__":
                 "backend_stable": success,
                 "timestamp": datetime.now().isoformat()
             },
-            "test_results": test_results,
+            "test_results": [{**r, "timestamp": iso_from_ns(r["timestamp_ns"])} for r in test_results],
             "failed_tests": failed_tests,
             "backend_url": API_URL,
             "test_credentials": TEST_EMAIL
         }, f, indent=2)
     
-    print(f"📄 Detailed results saved to: {results_file}")
+    out(f"📄 Detailed results saved to: {results_file}")
     sys.exit(0 if success else 1)
\ No newline at end of file
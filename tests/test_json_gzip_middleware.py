@@ -0,0 +1,87 @@
+import os
+import sys
+
+from fastapi import FastAPI
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from server import JSONGZipMiddleware  # noqa: E402
+
+BIG_JSON = {"tracks": ["x" * 50] * 40}
+
+
+def make_client(tmp_path):
+    audio = tmp_path / "track.mp3"
+    audio.write_bytes(b"ID3" + b"\x00" * 4000)
+
+    app = FastAPI()
+    app.add_middleware(JSONGZipMiddleware, minimum_size=500, compresslevel=5)
+
+    @app.get("/json")
+    def big_json():
+        return BIG_JSON
+
+    @app.get("/small")
+    def small_json():
+        return {"ok": True}
+
+    @app.get("/stream")
+    def stream_json():
+        return StreamingResponse(iter([b'{"a":"', b"y" * 2000, b'"}']), media_type="application/json")
+
+    @app.get("/file")
+    def audio_file():
+        return FileResponse(audio, media_type="audio/mpeg")
+
+    @app.get("/range")
+    def partial():
+        return Response(
+            b"z" * 3000,
+            status_code=206,
+            media_type="application/json",
+            headers={"Content-Range": "bytes 0-2999/9000"},
+        )
+
+    return TestClient(app)
+
+
+def test_large_json_is_gzipped(tmp_path):
+    response = make_client(tmp_path).get("/json")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "accept-encoding" in response.headers["vary"].lower()
+    assert response.json() == BIG_JSON
+
+
+def test_small_json_is_not_gzipped(tmp_path):
+    response = make_client(tmp_path).get("/small")
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"ok": True}
+
+
+def test_streamed_json_is_gzipped(tmp_path):
+    response = make_client(tmp_path).get("/stream")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == {"a": "y" * 2000}
+
+
+def test_file_response_passes_through(tmp_path):
+    response = make_client(tmp_path).get("/file")
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-length"] == "4003"
+    assert response.content.startswith(b"ID3")
+
+
+def test_partial_content_passes_through(tmp_path):
+    response = make_client(tmp_path).get("/range")
+    assert response.status_code == 206
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-length"] == "3000"
+    assert response.headers["content-range"] == "bytes 0-2999/9000"
+
+
+def test_no_gzip_without_accept_encoding(tmp_path):
+    response = make_client(tmp_path).get("/json", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == BIG_JSON